@@ -3,8 +3,8 @@
 Verba Database Merge Driver - Custom Git merge driver for changes.db
 
 This script handles merge conflicts in the SQLite database by:
-1. Reading records from all three versions (base, current, other)
-2. Merging them using INSERT OR IGNORE to handle duplicates
+1. Attaching all three versions (base, current, other) to one connection
+2. Merging them using INSERT OR IGNORE ... SELECT to handle duplicates
 3. Writing the merged result to the current branch location
 
 Usage: git config merge.verba-db.driver "python3 verba/merge_db.py %O %A %B"
@@ -20,74 +20,135 @@ import sys
 import os
 from pathlib import Path
 
-def get_records_from_db(db_path):
-    """Extract all records from a database file"""
-    if not os.path.exists(db_path) or os.path.getsize(db_path) == 0:
-        return []
+def _open(db_path):
+    """Open a database connection with the per-connection write PRAGMAs applied"""
+    # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE, so the
+    # sqlite3 module never starts or commits one implicitly
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.execute('PRAGMA mmap_size=268435456')
+    return conn
+
+COLUMNS = 'change_hash, filename, file_change, timestamp, prompt, is_committed, commit_hash'
+INDEXES = (('idx_filename', 'filename'), ('idx_committed', 'is_committed'), ('idx_timestamp', 'timestamp'))
+INDEX_SQL = [f'CREATE INDEX IF NOT EXISTS {name} ON code_changes({column})' for name, column in INDEXES]
+
+# The whole schema as one script, so it is parsed and run in a single executescript call
+DDL = '''
+    CREATE TABLE IF NOT EXISTS code_changes (
+        change_hash TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        file_change TEXT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        prompt TEXT NOT NULL,
+        is_committed BOOLEAN DEFAULT FALSE,
+        commit_hash TEXT NULL
+    );
+''' + ''.join(f'    {sql};\n' for sql in INDEX_SQL)
+
+# When at least this many records are new to the output, and they are no fewer than
+# the records already there, the secondary indexes are dropped for the copy and rebuilt
+# afterwards, one sorted pass each instead of a b-tree insert per row. A rebuild re-sorts
+# the whole table, so it only pays when the merge makes up much of it
+BULK_INDEX_THRESHOLD = 10000
+
+def create_indexes(conn):
+    """Create the secondary indexes on code_changes if they are missing"""
+    # Statement by statement: executescript would commit the merge transaction first
+    for sql in INDEX_SQL:
+        conn.execute(sql)
+
+def attach_db(conn, alias, db_path):
+    """Attach a database file under alias and return its record count (None if unusable)"""
+    try:
+        if os.stat(db_path).st_size == 0:
+            return None
+    except FileNotFoundError:
+        return None
     
     try:
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.execute('''
-                SELECT change_hash, filename, file_change, timestamp, prompt, is_committed, commit_hash
-                FROM code_changes
-                ORDER BY timestamp ASC
-            ''')
-            return cursor.fetchall()
+        conn.execute(f'ATTACH DATABASE ? AS {alias}', (db_path,))
+    except Exception as e:
+        print(f"Warning: Could not attach {db_path}: {e}", file=sys.stderr)
+        return None
+    
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {alias}.code_changes').fetchone()[0]
     except Exception as e:
         print(f"Warning: Could not read from {db_path}: {e}", file=sys.stderr)
-        return []
+        conn.execute(f'DETACH DATABASE {alias}')
+        return None
+
+def count_new(conn, aliases):
+    """Count the distinct records in the attached aliases that are not in the output yet"""
+    union = ' UNION '.join(f'SELECT change_hash FROM {alias}.code_changes' for alias in aliases)
+    return conn.execute(f'''
+        SELECT COUNT(*) FROM ({union})
+        WHERE change_hash NOT IN (SELECT change_hash FROM main.code_changes)
+    ''').fetchone()[0]
 
 def merge_databases(base_path, current_path, other_path, output_path):
     """Merge three database versions into output database"""
     
-    # Get records from all three versions
-    base_records = get_records_from_db(base_path)
-    current_records = get_records_from_db(current_path)
-    other_records = get_records_from_db(other_path)
-    
-    print(f"Base records: {len(base_records)}")
-    print(f"Current records: {len(current_records)}")
-    print(f"Other records: {len(other_records)}")
-    
     # Create/initialize the output database
-    with sqlite3.connect(output_path) as conn:
+    conn = _open(output_path)
+    try:
         # Create the table structure
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS code_changes (
-                change_hash TEXT PRIMARY KEY,
-                filename TEXT NOT NULL,
-                file_change TEXT NOT NULL,
-                timestamp TIMESTAMP NOT NULL,
-                prompt TEXT NOT NULL,
-                is_committed BOOLEAN DEFAULT FALSE,
-                commit_hash TEXT NULL
-            )
-        ''')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_filename ON code_changes(filename)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_committed ON code_changes(is_committed)')
+        conn.executescript(DDL)
+        
+        # Attach the other versions so the merge runs inside SQLite. When the output
+        # is the current version (the git driver case) its records are already in place
+        sources = [('base', base_path), ('current', current_path), ('other', other_path)]
+        if os.path.abspath(current_path) == os.path.abspath(output_path):
+            sources.pop(1)
+            counts = {'current': conn.execute('SELECT COUNT(*) FROM code_changes').fetchone()[0]}
+        else:
+            counts = {}
+        
+        for alias, path in sources:
+            counts[alias] = attach_db(conn, alias, path)
         
-        # Combine all records (base + current + other)
-        all_records = []
-        all_records.extend(base_records)
-        all_records.extend(current_records)
-        all_records.extend(other_records)
+        print(f"Base records: {counts['base'] or 0}")
+        print(f"Current records: {counts['current'] or 0}")
+        print(f"Other records: {counts['other'] or 0}")
         
-        # Insert all records, using INSERT OR IGNORE to handle duplicates
-        # The change_hash PRIMARY KEY will automatically deduplicate
-        inserted_count = 0
-        for record in all_records:
-            try:
-                conn.execute('''
-                    INSERT OR IGNORE INTO code_changes 
-                    (change_hash, filename, file_change, timestamp, prompt, is_committed, commit_hash)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', record)
-                if conn.total_changes > 0:
-                    inserted_count += 1
-            except Exception as e:
-                print(f"Warning: Could not insert record {record[0][:8]}: {e}", file=sys.stderr)
+        # Copy every attached version in a single transaction, using INSERT OR IGNORE
+        # to handle duplicates. The change_hash PRIMARY KEY will automatically deduplicate
+        attached = [alias for alias, _ in sources if counts[alias] is not None]
+        incoming = sum(counts[alias] for alias in attached)
+        before = conn.total_changes
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Decide on the index rebuild from the records that will actually be inserted,
+            # not the attached totals, which mostly repeat what the output already holds
+            bulk = False
+            if incoming >= BULK_INDEX_THRESHOLD:
+                new_count = count_new(conn, attached)
+                existing = conn.execute('SELECT COUNT(*) FROM code_changes').fetchone()[0]
+                bulk = new_count >= BULK_INDEX_THRESHOLD and new_count >= existing
+            if bulk:
+                for name, _ in INDEXES:
+                    conn.execute(f'DROP INDEX IF EXISTS {name}')
+            for alias in attached:
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO code_changes ({COLUMNS})
+                    SELECT {COLUMNS} FROM {alias}.code_changes
+                ''')
+            if bulk:
+                create_indexes(conn)
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        inserted_count = conn.total_changes - before
         
         print(f"Merged {inserted_count} unique records into database")
+        conn.execute('PRAGMA optimize')
+    finally:
+        conn.close()
     
     return True
 
@@ -9,6 +9,21 @@ import os
 import sys
 from pathlib import Path
 
+DDL = '''
+    CREATE TABLE IF NOT EXISTS code_changes (
+        change_hash TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        file_change TEXT NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        prompt TEXT NOT NULL,
+        is_committed BOOLEAN DEFAULT FALSE,
+        commit_hash TEXT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_filename ON code_changes(filename);
+    CREATE INDEX IF NOT EXISTS idx_committed ON code_changes(is_committed);
+    CREATE INDEX IF NOT EXISTS idx_timestamp ON code_changes(timestamp);
+'''
+
 class VerbaDatabase:
     def __init__(self, project_root=None):
         self.project_root = Path(project_root or os.getcwd())
@@ -20,19 +35,12 @@ class VerbaDatabase:
         self.verba_dir.mkdir(exist_ok=True)
         
         with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                CREATE TABLE IF NOT EXISTS code_changes (
-                    change_hash TEXT PRIMARY KEY,
-                    filename TEXT NOT NULL,
-                    file_change TEXT NOT NULL,
-                    timestamp TIMESTAMP NOT NULL,
-                    prompt TEXT NOT NULL,
-                    is_committed BOOLEAN DEFAULT FALSE,
-                    commit_hash TEXT NULL
-                )
-            ''')
-            conn.execute('CREATE INDEX IF NOT EXISTS idx_filename ON code_changes(filename)')
-            conn.execute('CREATE INDEX IF NOT EXISTS idx_committed ON code_changes(is_committed)')
+            # WAL is persistent in the database file; the rest apply to this connection
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-65536')
+            conn.executescript(DDL)
             
         print(f"Database initialized: {self.db_path}")
     
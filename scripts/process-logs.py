@@ -6,6 +6,8 @@ Used by pre-commit hook to process logs in one pass instead of continuous monito
 
 import sqlite3
 import hashlib
+import itertools
+import mmap
 import re
 import os
 import sys
@@ -13,169 +15,187 @@ import argparse
 from datetime import datetime
 from pathlib import Path
 
+# prompts.txt patterns: a header line is either "[timestamp] User Prompt: text" or
+# "FILE: name", and a FILE header is followed by one dash separator line. A CRLF
+# line's '\r' is not part of either, as with the old text-mode read
+_RE_HEADER = re.compile(rb'^(?:\[([^\]\n]+)\] User Prompt: (.+?)|FILE: (.+?))\r?$', re.MULTILINE)
+_RE_SEP_LINE = re.compile(rb'(?:-+\r?(?:\n|\Z))?')
+_RE_ISO_TS = re.compile(r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}([+-]\d{2}:\d{2})?$')
+
+def _open(db_path):
+    """Open a database connection with the per-connection write PRAGMAs applied"""
+    # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE, so the
+    # sqlite3 module never starts or commits one implicitly
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.execute('PRAGMA mmap_size=268435456')
+    return conn
+
+def _to_lf(body):
+    """Translate CRLF and lone CR line breaks to LF, as the old text-mode read of prompts.txt did"""
+    if b'\r' in body:
+        body = body.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return body
+
 class LogProcessor:
     def __init__(self, db_path, prompts_file):
         self.db_path = db_path
         self.prompts_file = prompts_file
+        self._conn = None
+        self._changes_parsed = 0
+        self._enc = {}
         
     # Position tracking methods removed - now processing entire file each time
     
     def process_all_logs(self):
         """Process entire prompts.txt content and clear the file afterwards"""
-        if not os.path.exists(self.prompts_file):
+        # Map the file read-only and parse it in place rather than reading it into memory;
+        # open() itself reports a missing file, so no separate existence check is needed
+        try:
+            with open(self.prompts_file, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    print("No content to process")
+                    return 0
+                
+                print(f"Processing entire prompts.txt ({size} bytes)...")
+                
+                # Parsed rows stream straight into one transaction; prompts.txt is kept on failure
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    self._changes_parsed = 0
+                    stored = self._write_changes(self._iter_changes(mm))
+                    changes_processed = self._changes_parsed
+        except FileNotFoundError:
             print(f"Prompts file not found: {self.prompts_file}", file=sys.stderr)
             return 0
-        
-        # Read entire file content
-        try:
-            with open(self.prompts_file, 'r', encoding='utf-8') as f:
-                content = f.read()
         except Exception as e:
-            print(f"Error reading prompts file: {e}", file=sys.stderr)
+            print(f"Error processing prompts file: {e}", file=sys.stderr)
             return 0
         
-        if not content.strip():
-            print("No content to process")
-            return 0
-        
-        print(f"Processing entire prompts.txt ({len(content)} characters)...")
-        
-        # Process all content
-        changes_processed = self._parse_and_store_changes(content)
-        
         # Clear the prompts file after successful processing
         try:
-            with open(self.prompts_file, 'w', encoding='utf-8') as f:
-                f.write('')
+            os.truncate(self.prompts_file, 0)
             print(f"Cleared prompts.txt after processing")
         except Exception as e:
             print(f"Error clearing prompts file: {e}", file=sys.stderr)
         
-        print(f"Processed {changes_processed} changes")
+        print(f"Processed {changes_processed} changes ({stored} new in database)")
         return changes_processed
     
-    def _parse_and_store_changes(self, content):
-        """Parse content and extract code changes (adapted from monitor.py)"""
-        lines = content.split('\n')
-        changes_count = 0
-        
-        # State tracking
+    def _iter_changes(self, buf):
+        """Parse the mapped prompts.txt and yield a database row per code change (adapted from monitor.py)"""
+        for filename, file_change, timestamp, prompt in self._iter_file_changes(buf):
+            row = self._make_row(filename, file_change, timestamp, prompt)
+            if row is not None:
+                self._changes_parsed += 1
+                yield row
+    
+    def _iter_file_changes(self, buf):
+        """Yield (filename, change bytes, timestamp, prompt) for every FILE block in buf"""
         current_timestamp = None
         current_prompt = None
         current_file = None
-        file_changes = []
-        pending_file = None
-        pending_file_changes = []
+        body_start = None
         
-        for line in lines:
-            # Extract timestamp and prompt
-            timestamp_match = re.match(r'^\[([^\]]+)\] User Prompt: (.+)$', line)
-            if timestamp_match:
-                # Store any pending changes with the OLD timestamp/prompt before updating
-                if current_file and file_changes and current_timestamp and current_prompt:
-                    self._store_change(current_file, '\n'.join(file_changes), current_timestamp, current_prompt)
-                    changes_count += 1
-                
-                # Store pending file if we have one
-                if pending_file and pending_file_changes and current_timestamp and current_prompt:
-                    self._store_change(pending_file, '\n'.join(pending_file_changes), current_timestamp, current_prompt)
-                    changes_count += 1
-                
-                # Clear state for new prompt
-                file_changes = []
-                current_file = None
-                pending_file = None
-                pending_file_changes = []
-                
-                # Update to new timestamp/prompt
-                current_timestamp = timestamp_match.group(1)
-                current_prompt = timestamp_match.group(2)
-                continue
-            
-            # Extract file name
-            file_match = re.match(r'^FILE: (.+)$', line)
-            if file_match:
-                # Store previous file if we have changes
-                if current_file and file_changes and current_timestamp and current_prompt:
-                    self._store_change(current_file, '\n'.join(file_changes), current_timestamp, current_prompt)
-                    changes_count += 1
-                
-                # Store pending file if we have one
-                if pending_file and pending_file_changes and current_timestamp and current_prompt:
-                    self._store_change(pending_file, '\n'.join(pending_file_changes), current_timestamp, current_prompt)
-                    changes_count += 1
-                
-                # Start new file
-                new_file = file_match.group(1)
-                if current_file:
-                    # We already had a file, so the new one becomes pending
-                    pending_file = new_file
-                    pending_file_changes = []
-                else:
-                    # This is the first file for this prompt
-                    current_file = new_file
-                    file_changes = []
-                continue
+        # One regex pass finds every header; a file's change is the span up to the next one
+        for match in itertools.chain(_RE_HEADER.finditer(buf), [None]):
+            body_end = match.start() if match else len(buf)
             
-            # Skip separator lines
-            if re.match(r'^-+$', line):
-                continue
+            # Emit the previous file with the OLD timestamp/prompt before updating
+            if current_file and current_timestamp and current_prompt:
+                # Drop the line break that ends the body's last line before the next header;
+                # at end of file the span is kept as is, trailing newline included
+                if match is not None and body_end > body_start and buf[body_end - 1:body_end] == b'\n':
+                    body_end -= 1
+                    if body_end > body_start and buf[body_end - 1:body_end] == b'\r':
+                        body_end -= 1
+                if body_start < body_end:
+                    yield current_file, _to_lf(buf[body_start:body_end]), current_timestamp, current_prompt
             
-            # Collect content for current file or pending file
-            if current_file:
-                # Add to current file if it's a diff line or regular content
-                if (re.match(r'^\s*\d+\s*[+→-]\s+', line) or 
-                    (line.strip() and not line.startswith('FILE:') and not re.match(r'^-+$', line) and not re.match(r'^\[([^\]]+)\] User Prompt:', line))):
-                    file_changes.append(line)
-                elif line.strip() == "":  # Include empty lines as part of content
-                    file_changes.append(line)
+            if match is None:
+                break
             
-            # If we have a pending file, collect content for it
-            if pending_file and not re.match(r'^\[([^\]]+)\] User Prompt:', line) and not line.startswith('FILE:') and not re.match(r'^-+$', line):
-                pending_file_changes.append(line)
-        
-        # Store final changes if we have them
-        if current_file and file_changes and current_timestamp and current_prompt:
-            self._store_change(current_file, '\n'.join(file_changes), current_timestamp, current_prompt)
-            changes_count += 1
-        
-        if pending_file and pending_file_changes and current_timestamp and current_prompt:
-            self._store_change(pending_file, '\n'.join(pending_file_changes), current_timestamp, current_prompt)
-            changes_count += 1
-        
-        return changes_count
+            if match.group(3) is not None:
+                # Start a new file, skipping the newline and the one separator line under its
+                # header; dash-only lines after that (e.g. '---' front matter) are content
+                current_file = match.group(3).decode('utf-8')
+                body_start = _RE_SEP_LINE.match(buf, match.end() + 1).end()
+            else:
+                # Update to new timestamp/prompt
+                current_file = None
+                current_timestamp = match.group(1).decode('utf-8')
+                current_prompt = match.group(2).decode('utf-8')
     
-    def _store_change(self, filename, file_change, timestamp, prompt):
-        """Store a code change in the database (same as monitor.py)"""
+    def _make_row(self, filename, file_change, timestamp, prompt):
+        """Build the code_changes row for a code change (raw UTF-8 bytes), or None to skip it"""
         if not all([filename, file_change, timestamp, prompt]):
-            return
+            return None
         
         # Skip if content is just empty lines
         if not file_change.strip():
-            return
+            return None
             
-        # Create hash
-        hash_input = f"{filename}{file_change}{timestamp}"
-        change_hash = hashlib.sha256(hash_input.encode()).hexdigest()
+        # Create hash, feeding the parts in turn instead of building one concatenated copy.
+        # change_hash is also the record's identity for the hooks (the pre-commit export
+        # and the post-commit is_committed update match on it), so it stays a stored column
+        h = hashlib.sha256()
+        h.update(self._encoded(filename))
+        h.update(file_change)
+        h.update(self._encoded(timestamp))
+        change_hash = h.hexdigest()
         
-        # Parse timestamp
-        try:
-            # Convert ISO timestamp to datetime
-            dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-        except ValueError:
-            dt = datetime.now()
+        # Bind the timestamp as text in the form the sqlite3 datetime adapter wrote
+        # (datetime.isoformat(' ')). The common whole-second form (what `date -Iseconds`
+        # logs) already is that text bar the 'T', so it skips the datetime round trip
+        ts = timestamp.replace('Z', '+00:00')
+        if _RE_ISO_TS.match(ts):
+            ts = ts[:10] + ' ' + ts[11:]
+        else:
+            try:
+                ts = datetime.fromisoformat(ts).isoformat(' ')
+            except ValueError:
+                ts = datetime.now().isoformat(' ')
         
-        # Store in database
+        return (change_hash, filename, file_change.decode('utf-8'), ts, prompt, False, None)
+    
+    def _encoded(self, text):
+        """Return the UTF-8 encoding of text, cached since names and timestamps repeat across FILE blocks"""
+        encoded = self._enc.get(text)
+        if encoded is None:
+            encoded = self._enc[text] = text.encode()
+        return encoded
+    
+    def _get_conn(self):
+        """Open the database connection on first use and reuse it afterwards"""
+        if self._conn is None:
+            self._conn = _open(self.db_path)
+        return self._conn
+    
+    def _write_changes(self, rows):
+        """Insert rows (any iterable) in a single transaction, returning how many were new"""
+        conn = self._get_conn()
+        before = conn.total_changes
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute('''
-                    INSERT OR IGNORE INTO code_changes 
-                    (change_hash, filename, file_change, timestamp, prompt, is_committed, commit_hash)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (change_hash, filename, file_change, dt, prompt, False, None))
-                
-        except Exception as e:
-            print(f"Error storing change: {e}", file=sys.stderr)
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('''
+                INSERT OR IGNORE INTO code_changes 
+                (change_hash, filename, file_change, timestamp, prompt, is_committed, commit_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return conn.total_changes - before
+    
+    def close(self):
+        """Close the database connection if one was opened"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
 
     # Reset position method removed - no longer needed
 
@@ -196,7 +216,10 @@ def main():
     
     processor = LogProcessor(str(db_path), str(prompts_file))
     
-    changes_processed = processor.process_all_logs()
+    try:
+        changes_processed = processor.process_all_logs()
+    finally:
+        processor.close()
     
     if changes_processed == 0:
         print("No changes to process")